@@ -0,0 +1,182 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted within the configured limits."""
+
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bound the number of in-flight requests globally and per session.
+
+    Requests that cannot start immediately wait in a bounded queue until a slot
+    frees up or their deadline passes, and are served in arrival order. A
+    session may have at most ``max_per_session`` requests running and as many
+    again waiting. Requests held back only by their own session's limit do not
+    count against ``max_queue``, so one busy session cannot fill the queue.
+    """
+
+    def __init__(self, name, max_active, max_per_session, max_queue, queue_timeout):
+        self.name = name
+        self.max_active = max_active
+        self.max_per_session = max_per_session
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queue = deque()  # session ids of waiting requests, oldest first
+        self._session_active = {}
+        self._session_waiting = {}
+        self._admitted = 0
+        self._rejected = {"queue_full": 0, "session_limit": 0, "timeout": 0}
+        self._avg_service_time = 1.0  # seconds, exponentially weighted
+
+    @contextmanager
+    def admit(self, session_id):
+        """Hold an admission slot for ``session_id`` for the duration of the block."""
+        self._acquire(session_id)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(session_id, time.monotonic() - start)
+
+    def _session_blocked(self, session_id):
+        return self._session_active.get(session_id, 0) >= self.max_per_session
+
+    def _can_start(self, session_id):
+        return self._active < self.max_active and not self._session_blocked(session_id)
+
+    def _first_ready(self):
+        """Return the oldest waiting ticket that could start now, if any."""
+        for ticket in self._queue:
+            if self._can_start(ticket[0]):
+                return ticket
+        return None
+
+    def _global_waiting(self):
+        """Count waiters held back by global capacity rather than their session."""
+        return sum(1 for ticket in self._queue if not self._session_blocked(ticket[0]))
+
+    def _retry_after(self):
+        """Estimate how long until the current backlog drains, in whole seconds."""
+        backlog = self._global_waiting() + 1
+        return max(1, math.ceil(self._avg_service_time * backlog / self.max_active))
+
+    def _reject(self, reason, status, message):
+        self._rejected[reason] += 1
+        raise AdmissionRejected(status, message, self._retry_after())
+
+    def _acquire(self, session_id):
+        with self._cond:
+            if self._can_start(session_id) and self._first_ready() is None:
+                self._start(session_id)
+                return
+
+            if self._session_waiting.get(session_id, 0) >= self.max_per_session:
+                self._reject(
+                    "session_limit",
+                    429,
+                    "Too many concurrent requests for this session",
+                )
+            if (
+                not self._session_blocked(session_id)
+                and self._global_waiting() >= self.max_queue
+            ):
+                self._reject("queue_full", 503, "Server is busy, please retry later")
+
+            # A fresh list per request, so tickets compare by identity
+            ticket = [session_id]
+            self._queue.append(ticket)
+            self._session_waiting[session_id] = (
+                self._session_waiting.get(session_id, 0) + 1
+            )
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self._first_ready() is not ticket:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject(
+                            "timeout", 503, "Timed out waiting for a free worker slot"
+                        )
+                    self._cond.wait(remaining)
+                self._start(session_id)
+            finally:
+                self._queue.remove(ticket)
+                self._session_waiting[session_id] -= 1
+                if not self._session_waiting[session_id]:
+                    del self._session_waiting[session_id]
+                # Whoever is next in line may be able to start now
+                self._cond.notify_all()
+
+    def _start(self, session_id):
+        self._active += 1
+        self._session_active[session_id] = self._session_active.get(session_id, 0) + 1
+        self._admitted += 1
+
+    def _release(self, session_id, elapsed):
+        with self._cond:
+            self._active -= 1
+            self._session_active[session_id] -= 1
+            if not self._session_active[session_id]:
+                del self._session_active[session_id]
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * elapsed
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return a snapshot of current load and rejection counters."""
+        with self._cond:
+            return {
+                "name": self.name,
+                "active": self._active,
+                "queue_depth": self._global_waiting(),
+                "session_waiting": len(self._queue) - self._global_waiting(),
+                "max_active": self.max_active,
+                "max_per_session": self.max_per_session,
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout,
+                "admitted": self._admitted,
+                "rejected": dict(self._rejected),
+                "avg_service_time": round(self._avg_service_time, 3),
+            }
+
+
+class SessionLocks:
+    """Hand out one lock per session so history updates never interleave.
+
+    Each lock is reference counted and dropped once nobody holds or waits on
+    it, so arbitrary client-supplied session ids don't accumulate forever.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}  # session id -> [lock, holders]
+
+    @contextmanager
+    def hold(self, session_id):
+        """Hold the lock for ``session_id`` for the duration of the block."""
+        with self._guard:
+            entry = self._locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[session_id]
+
+    def __len__(self):
+        with self._guard:
+            return len(self._locks)
@@ -0,0 +1,124 @@
+"""Benchmark flat chunk scanning against two-stage (paper routing) retrieval.
+
+Builds synthetic sessions of increasing size and times ``retrieve_chunks`` with
+routing disabled (flat scan over every chunk) and enabled. Papers share most of
+their vocabulary: each draws from a common Zipf-distributed word list, a small
+set of topic terms that overlaps with other papers, and a few words of its own.
+
+Recall is the share of queries for which every best-scoring chunk of the flat
+scan is still returned after routing. "Attainable" is the share of queries
+whose best chunks come from no more than ``fanout`` papers, i.e. the most any
+router could recall at that fan-out.
+
+    python bench_retrieval.py --papers 10 50 100 200 --fanout 5
+"""
+
+import argparse
+import random
+import time
+
+from retrieval import build_paper_summary, retrieve_chunks
+
+COMMON_WORDS = [f"w{i:04d}" for i in range(2000)]
+COMMON_WEIGHTS = [1 / (i + 1) for i in range(len(COMMON_WORDS))]
+TOPIC_WORDS = [f"t{i:03d}x" for i in range(400)]
+TOPICS_PER_PAPER = 30
+TOPIC_SHARE = 0.15
+RARE_PER_PAPER = 3
+CHUNK_SIZE = 4000
+CHUNKS_PER_PAPER = 12
+
+
+def make_paper(rng, paper_id):
+    """Generate a synthetic paper mixing shared, topic and paper-specific words."""
+    topics = rng.sample(TOPIC_WORDS, TOPICS_PER_PAPER)
+    rare = [f"r{paper_id:04d}{j}z" for j in range(RARE_PER_PAPER)]
+
+    word_count = CHUNK_SIZE * CHUNKS_PER_PAPER // 6
+    words = rng.choices(COMMON_WORDS, COMMON_WEIGHTS, k=word_count)
+    for i in rng.sample(range(word_count), int(word_count * TOPIC_SHARE)):
+        words[i] = rng.choice(topics)
+    for word in rare:
+        words[rng.randrange(word_count)] = word
+
+    text = f"Abstract {' '.join(words)}"
+    chunks = [text[i : i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
+    filename = f"paper_{paper_id}.pdf"
+    return {
+        "filename": filename,
+        "chunks": chunks,
+        "summary": build_paper_summary(filename, text),
+        "keywords": topics + rare,
+    }
+
+
+def make_query(rng, papers):
+    """Ask about a common word and a topic or rare word from one paper."""
+    paper = rng.choice(papers)
+    common = rng.choice(rng.choice(paper["chunks"]).split())
+    return f"{common} {rng.choice(paper['keywords'])}"
+
+
+def best_chunks(query, chunks):
+    """Return the ids of the chunks with the highest keyword-match score."""
+    query_terms = set(query.lower().split())
+    scores = {
+        id(chunk): sum(term in chunk.lower() for term in query_terms)
+        for chunk in chunks
+    }
+    top = max(scores.values(), default=0)
+    return {chunk_id for chunk_id, score in scores.items() if score == top and top > 0}
+
+
+def recall(queries, papers, fanout):
+    """Return (recall, attainable recall) of routed retrieval over ``queries``."""
+    hits = attainable = 0
+    for query in queries:
+        best = best_chunks(query, retrieve_chunks(query, papers, fanout=0))
+        routed = {id(chunk) for chunk in retrieve_chunks(query, papers, fanout)}
+        owners = {
+            i
+            for i, paper in enumerate(papers)
+            if any(id(chunk) in best for chunk in paper["chunks"])
+        }
+        hits += best <= routed
+        attainable += len(owners) <= fanout
+    return hits / len(queries), attainable / len(queries)
+
+
+def time_queries(queries, papers, fanout):
+    start = time.perf_counter()
+    for query in queries:
+        retrieve_chunks(query, papers, fanout)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--papers", type=int, nargs="+", default=[10, 25, 50, 100, 200])
+    parser.add_argument("--fanout", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [make_paper(rng, paper_id) for paper_id in range(max(args.papers))]
+
+    print(
+        f"{'papers':>8} {'flat ms':>10} {'routed ms':>10} {'speedup':>8} {'recall':>8}"
+        f" {'attainable':>11}"
+    )
+    for count in args.papers:
+        papers = corpus[:count]
+        queries = [make_query(rng, papers) for _ in range(args.queries)]
+        flat = time_queries(queries, papers, fanout=0)
+        routed = time_queries(queries, papers, fanout=args.fanout)
+        hit_rate, attainable = recall(queries, papers, args.fanout)
+        print(
+            f"{count:>8} {flat:>10.2f} {routed:>10.2f} {flat / routed:>7.1f}x"
+            f" {hit_rate:>7.0%} {attainable:>10.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
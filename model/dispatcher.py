@@ -0,0 +1,590 @@
+"""Multi-process serving mode for the paper chat API.
+
+A front dispatcher consistent-hashes ``session_id`` onto a fixed pool of
+worker processes. Each worker runs the regular paper chat app and keeps its
+shard of sessions in its own memory, so retrieval and ingestion spread over
+all cores instead of contending for one GIL.
+
+Admission limits (see server.py) are enforced by each worker separately, so the
+effective global limits are the number of workers times the configured values.
+Size UPLOAD_MAX_ACTIVE, CHAT_MAX_ACTIVE and friends per worker accordingly.
+
+    python dispatcher.py --workers 4 --port 5000
+"""
+
+import argparse
+import bisect
+import hashlib
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from flask import Flask, Blueprint, request, jsonify, make_response
+
+from admission import AdmissionRejected
+
+WORKER_HOST = "127.0.0.1"
+WORKER_START_TIMEOUT = 60  # seconds to wait for a new worker to come up
+PROXY_TIMEOUT = 300  # uploads and LLM calls can both be slow
+INTERNAL_TIMEOUT = 30
+ROUTE_WAIT_TIMEOUT = 15  # longest a request waits for its session to be moved
+ROUTE_RETRY_AFTER = 5
+MAX_CONTENT_LENGTH = 32 * 1024 * 1024  # keep in sync with server.py
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes for even key spread."""
+
+    def __init__(self, replicas=100):
+        self.replicas = replicas
+        self._keys = []
+        self._owners = {}
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            key = self._hash(f"{node}#{i}")
+            bisect.insort(self._keys, key)
+            self._owners[key] = node
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            key = self._hash(f"{node}#{i}")
+            self._keys.remove(key)
+            del self._owners[key]
+
+    def copy(self):
+        ring = HashRing(self.replicas)
+        ring._keys = list(self._keys)
+        ring._owners = dict(self._owners)
+        return ring
+
+    def get(self, key):
+        """Return the node owning ``key``."""
+        if not self._keys:
+            raise LookupError("No workers available")
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._owners[self._keys[index]]
+
+
+class Worker:
+    """A worker process serving one shard of sessions, plus its load counters."""
+
+    def __init__(self, name, port, process):
+        self.name = name
+        self.port = port
+        self.process = process
+        self.url = f"http://{WORKER_HOST}:{port}"
+        self.routed = 0
+        self.in_flight = 0
+        self.errors = 0
+        self.total_time = 0.0
+
+
+def run_worker(port):
+    """Entry point of a worker process."""
+    # Imported here so the dispatcher itself never loads Groq/NLTK/PyMuPDF
+    from server import create_worker_app
+
+    app = create_worker_app()
+    app.run(host=WORKER_HOST, port=port, threaded=True, use_reloader=False)
+
+
+class WorkerPool:
+    """Own the worker processes and route sessions to them.
+
+    Adding or removing a worker computes the new ring up front and pauses only
+    the sessions whose owner changes: their in-flight requests drain, their state
+    moves to the new owner, and then the new ring takes over. Requests for every
+    other session keep flowing. Workers whose process has died are replaced.
+    """
+
+    def __init__(self, base_port):
+        self._context = multiprocessing.get_context("spawn")
+        self._ring = HashRing()
+        self._workers = {}
+        self._next_id = 0
+        self._next_port = base_port
+
+        self._cond = threading.Condition()
+        self._resize_lock = threading.Lock()  # one add/remove at a time
+        self._pending_ring = None  # the ring being moved to during a resize
+        self._session_in_flight = {}
+        self._in_flight = 0
+        self._recovering = set()
+        self._rebalances = 0
+        self._sessions_moved = 0
+        # Worker name -> session ids whose copy there could not be dropped
+        self._stale = {}
+
+    def start(self, count):
+        for _ in range(count):
+            self.add_worker()
+
+    def _spawn(self):
+        with self._cond:
+            name = f"worker-{self._next_id}"
+            port = self._next_port
+            self._next_id += 1
+            self._next_port += 1
+
+        process = self._context.Process(
+            target=run_worker, args=(port,), name=name, daemon=True
+        )
+        process.start()
+        worker = Worker(name, port, process)
+
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if not process.is_alive():
+                break
+            try:
+                requests.get(f"{worker.url}/internal/sessions", timeout=1)
+                return worker
+            except requests.RequestException:
+                time.sleep(0.2)
+
+        self._stop(worker)
+        raise RuntimeError(f"Worker {name} failed to start on port {port}")
+
+    @staticmethod
+    def _stop(worker):
+        worker.process.terminate()
+        worker.process.join()
+
+    def add_worker(self):
+        """Start a new worker and move the sessions it now owns onto it."""
+        worker = self._spawn()
+        try:
+            with self._resize_lock:
+                with self._cond:
+                    sources = list(self._workers.values())
+                    # Known to the pool so it can receive sessions, but not on
+                    # the ring (and so not routed to) until the move completes
+                    self._workers[worker.name] = worker
+                ring = self._ring.copy()
+                ring.add(worker.name)
+                self._move_to(ring, sources)
+        except Exception:
+            with self._cond:
+                self._workers.pop(worker.name, None)
+            self._stop(worker)
+            raise
+        return worker.name
+
+    def remove_worker(self, name):
+        """Hand a worker's sessions to the remaining workers and stop it.
+
+        A worker whose process has died has nothing left to hand over, so its
+        sessions are simply reassigned.
+        """
+        with self._resize_lock:
+            with self._cond:
+                if name not in self._workers:
+                    raise KeyError(f"Unknown worker: {name}")
+                if len(self._workers) == 1:
+                    raise ValueError("Cannot remove the last worker")
+                worker = self._workers[name]
+            ring = self._ring.copy()
+            ring.remove(name)
+            self._move_to(ring, [worker])
+            with self._cond:
+                del self._workers[name]
+            self._stale.pop(name, None)
+        self._stop(worker)
+
+    def _is_moving(self, session_id):
+        return self._pending_ring is not None and self._pending_ring.get(
+            session_id
+        ) != self._ring.get(session_id)
+
+    def _move_to(self, ring, sources):
+        """Switch routing to ``ring``, moving sessions held by ``sources``.
+
+        Sessions are copied to their new owners first and only dropped from their
+        sources once every copy has been imported and the new ring is live. If any
+        step fails, the copies already made are dropped again, the old ring stays
+        in place and the sources keep everything.
+        """
+        with self._cond:
+            self._pending_ring = ring
+            # Let requests already running on moving sessions finish first
+            while any(self._is_moving(sid) for sid in self._session_in_flight):
+                self._cond.wait()
+
+        try:
+            moves = self._plan_moves(ring, sources)
+            self._copy(moves)
+        except Exception:
+            with self._cond:
+                self._pending_ring = None
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            self._ring = ring
+            self._pending_ring = None
+            self._rebalances += 1
+            self._cond.notify_all()
+
+        # Every new owner has its copy now; a failed drop only leaves a stale,
+        # unrouted copy on the source, which is retried on the next resize
+        for (source, owner), session_ids in moves.items():
+            self._drop(source, session_ids)
+            self._sessions_moved += len(session_ids)
+
+    def _plan_moves(self, ring, sources):
+        """Group the sessions on ``sources`` that ``ring`` assigns elsewhere."""
+        # Retry dropping copies left behind by earlier failures first, so they
+        # can never be moved over the live state on the session's owner
+        for worker in [*self._workers.values(), *sources]:
+            stale = self._stale.pop(worker.name, None)
+            if stale and worker.process.is_alive():
+                self._drop(worker, sorted(stale))
+
+        moves = {}
+        for worker in sources:
+            if not worker.process.is_alive():
+                continue  # its sessions died with it
+            response = requests.get(
+                f"{worker.url}/internal/sessions", timeout=INTERNAL_TIMEOUT
+            )
+            response.raise_for_status()
+            stale = self._stale.get(worker.name, set())
+            for session_id in response.json()["sessions"]:
+                owner = ring.get(session_id)
+                if owner != worker.name and session_id not in stale:
+                    moves.setdefault((worker, owner), []).append(session_id)
+        return moves
+
+    def _copy(self, moves):
+        """Import every planned move on its new owner, undoing all on failure."""
+        imported = []
+        try:
+            for (source, owner), session_ids in moves.items():
+                exported = self._post(source, "export", {"session_ids": session_ids})
+                self._post(self._workers[owner], "import", exported)
+                self._stale.get(owner, set()).difference_update(session_ids)
+                imported.append((self._workers[owner], session_ids))
+        except Exception:
+            for owner, session_ids in imported:
+                self._drop(owner, session_ids)
+            raise
+
+    def _post(self, worker, action, payload):
+        response = requests.post(
+            f"{worker.url}/internal/{action}", json=payload, timeout=INTERNAL_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _drop(self, worker, session_ids):
+        """Drop session copies from ``worker``, remembering any that failed."""
+        try:
+            self._post(worker, "drop", {"session_ids": session_ids})
+        except requests.RequestException:
+            self._stale.setdefault(worker.name, set()).update(session_ids)
+
+    def _recover(self, worker):
+        """Replace a dead worker in the background. Call with ``_cond`` held."""
+        if worker.name in self._recovering:
+            return
+        self._recovering.add(worker.name)
+        threading.Thread(target=self._replace, args=(worker,), daemon=True).start()
+
+    def _replace(self, worker):
+        try:
+            # Add first so the pool never drops to zero workers
+            self.add_worker()
+            self.remove_worker(worker.name)
+            print(f"Replaced dead worker {worker.name}")
+        except Exception as e:
+            print(f"Failed to replace dead worker {worker.name}: {str(e)}")
+        finally:
+            with self._cond:
+                self._recovering.discard(worker.name)
+
+    @contextmanager
+    def route(self, session_id):
+        """Yield the worker owning ``session_id`` while counting it as in flight.
+
+        Raises AdmissionRejected (503) if the session is being moved for longer
+        than ROUTE_WAIT_TIMEOUT or its worker has died.
+        """
+        with self._cond:
+            deadline = time.monotonic() + ROUTE_WAIT_TIMEOUT
+            while self._is_moving(session_id):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AdmissionRejected(
+                        503,
+                        "Session is being moved to another worker, please retry",
+                        ROUTE_RETRY_AFTER,
+                    )
+                self._cond.wait(remaining)
+
+            worker = self._workers[self._ring.get(session_id)]
+            if not worker.process.is_alive():
+                self._recover(worker)
+                raise AdmissionRejected(
+                    503,
+                    "Worker for this session is restarting, please retry",
+                    ROUTE_RETRY_AFTER,
+                )
+
+            self._in_flight += 1
+            self._session_in_flight[session_id] = (
+                self._session_in_flight.get(session_id, 0) + 1
+            )
+            worker.in_flight += 1
+            worker.routed += 1
+        start = time.monotonic()
+        try:
+            yield worker
+        except requests.RequestException:
+            with self._cond:
+                worker.errors += 1
+            raise
+        finally:
+            with self._cond:
+                worker.total_time += time.monotonic() - start
+                worker.in_flight -= 1
+                self._in_flight -= 1
+                self._session_in_flight[session_id] -= 1
+                if not self._session_in_flight[session_id]:
+                    del self._session_in_flight[session_id]
+                self._cond.notify_all()
+
+    def stats(self):
+        """Return per-shard load statistics, including each worker's own counters."""
+        with self._cond:
+            workers = list(self._workers.values())
+            for worker in workers:
+                if not worker.process.is_alive():
+                    self._recover(worker)
+            pool = {
+                "workers": len(workers),
+                "in_flight": self._in_flight,
+                "rebalancing": self._pending_ring is not None,
+                "recovering": sorted(self._recovering),
+                "rebalances": self._rebalances,
+                "sessions_moved": self._sessions_moved,
+            }
+
+        shards = []
+        for worker in workers:
+            shard = {
+                "name": worker.name,
+                "port": worker.port,
+                "pid": worker.process.pid,
+                "alive": worker.process.is_alive(),
+                "routed": worker.routed,
+                "in_flight": worker.in_flight,
+                "errors": worker.errors,
+                "avg_latency_ms": round(
+                    worker.total_time / worker.routed * 1000 if worker.routed else 0, 2
+                ),
+            }
+            try:
+                response = requests.get(
+                    f"{worker.url}/internal/sessions", timeout=INTERNAL_TIMEOUT
+                )
+                info = response.json()
+                shard["sessions"] = len(info["sessions"])
+                shard["papers"] = info["papers"]
+                shard["admission"] = info["admission"]
+            except requests.RequestException as e:
+                shard["error"] = str(e)
+            shards.append(shard)
+
+        pool["shards"] = shards
+        return pool
+
+    def shutdown(self):
+        for worker in self._workers.values():
+            self._stop(worker)
+
+
+class SizedStream:
+    """Request body stream that reports its length to ``requests``.
+
+    Without a length, ``requests`` falls back to chunked transfer encoding for
+    werkzeug's input stream; with it the upload is streamed with Content-Length.
+    """
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+
+def forward(pool, session_id, method, path, **kwargs):
+    """Proxy a request to the worker owning ``session_id``."""
+    try:
+        with pool.route(session_id) as worker:
+            upstream = requests.request(
+                method, f"{worker.url}{path}", timeout=PROXY_TIMEOUT, **kwargs
+            )
+    except requests.RequestException as e:
+        return jsonify({"error": f"Worker unavailable: {str(e)}"}), 502
+
+    response = make_response(upstream.content, upstream.status_code)
+    response.headers["Content-Type"] = upstream.headers.get(
+        "Content-Type", "application/json"
+    )
+    if "Retry-After" in upstream.headers:
+        response.headers["Retry-After"] = upstream.headers["Retry-After"]
+    return response
+
+
+def create_dispatcher_blueprint(pool):
+    dispatch_bp = Blueprint("dispatch", __name__)
+
+    @dispatch_bp.route("/upload_paper", methods=["POST"])
+    def upload_paper():
+        """Flask route to forward a paper upload to the session's worker.
+
+        With session_id in the query string or X-Session-ID header, the multipart
+        body is streamed through untouched. Clients that only send it as a form
+        field still work, but their upload is parsed here and re-encoded for the
+        worker, which costs memory in the dispatcher.
+        """
+        session_id = request.args.get("session_id") or request.headers.get(
+            "X-Session-ID"
+        )
+        if session_id:
+            body = request.stream
+            if request.content_length is not None:
+                body = SizedStream(body, request.content_length)
+            return forward(
+                pool,
+                session_id,
+                "POST",
+                request.path,
+                params=request.args,
+                data=body,
+                headers={
+                    "Content-Type": request.content_type,
+                    "X-Session-ID": session_id,
+                },
+            )
+
+        session_id = request.form.get("session_id")
+        if not session_id:
+            return jsonify({"error": "Session ID is required"}), 400
+
+        files = [
+            (field, (file.filename, file.stream, file.mimetype))
+            for field, file in request.files.items(multi=True)
+        ]
+        return forward(
+            pool,
+            session_id,
+            "POST",
+            request.path,
+            data=list(request.form.items(multi=True)),
+            files=files,
+        )
+
+    @dispatch_bp.route("/chat", methods=["POST"])
+    @dispatch_bp.route("/clear_session", methods=["POST"])
+    def session_post():
+        """Flask route to forward JSON requests to the session's worker."""
+        data = request.json
+        session_id = data.get("session_id")
+        if not session_id:
+            return jsonify({"error": "Session ID is required"}), 400
+        return forward(pool, session_id, "POST", request.path, json=data)
+
+    @dispatch_bp.route("/list_papers", methods=["GET"])
+    def list_papers():
+        """Flask route to forward a paper listing to the session's worker."""
+        session_id = request.args.get("session_id")
+        if not session_id:
+            return jsonify({"error": "Session ID is required"}), 400
+        return forward(pool, session_id, "GET", request.path, params=request.args)
+
+    @dispatch_bp.route("/shard_stats", methods=["GET"])
+    def shard_stats():
+        """Flask route to expose per-shard load statistics."""
+        return jsonify(pool.stats())
+
+    @dispatch_bp.route("/workers", methods=["POST"])
+    def add_worker():
+        """Flask route to grow the pool by one worker and rebalance."""
+        try:
+            name = pool.add_worker()
+        except (RuntimeError, requests.RequestException) as e:
+            return jsonify({"error": f"Error adding worker: {str(e)}"}), 500
+        return jsonify({"success": True, "worker": name})
+
+    @dispatch_bp.route("/workers/<name>", methods=["DELETE"])
+    def remove_worker(name):
+        """Flask route to drain a worker into the rest of the pool and stop it."""
+        try:
+            pool.remove_worker(name)
+        except KeyError as e:
+            return jsonify({"error": str(e.args[0])}), 404
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except requests.RequestException as e:
+            return jsonify({"error": f"Error removing worker: {str(e)}"}), 500
+        return jsonify({"success": True, "worker": name})
+
+    @dispatch_bp.errorhandler(413)
+    def too_large(e):
+        return jsonify({"error": "File is too large"}), 413
+
+    # Sessions that are being moved, or whose worker is restarting
+    @dispatch_bp.errorhandler(AdmissionRejected)
+    def admission_rejected(e):
+        response = make_response(jsonify({"error": e.message}), e.status)
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+
+    return dispatch_bp
+
+
+# Create the front dispatcher application
+def create_dispatcher_app(pool):
+    app = Flask(__name__)
+    app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
+    app.register_blueprint(create_dispatcher_blueprint(pool), url_prefix="/api")
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--worker-base-port", type=int, default=5100)
+    args = parser.parse_args()
+
+    # Turn SIGTERM into a normal exit so the workers get shut down below
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+
+    pool = WorkerPool(args.worker_base_port)
+    try:
+        pool.start(args.workers)
+        print(f"Started {args.workers} workers")
+        app = create_dispatcher_app(pool)
+        app.run(host="0.0.0.0", port=args.port, threaded=True)
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import math
+import os
+import re
+from collections import Counter
+
+# Words that carry no routing signal; kept short on purpose since the
+# summaries only need to separate papers from each other.
+STOPWORDS = {
+    "the", "and", "for", "are", "with", "that", "this", "from", "was", "were",
+    "which", "these", "those", "have", "has", "had", "not", "but", "can", "our",
+    "their", "its", "into", "than", "then", "also", "such", "been", "use",
+    "used", "using", "between", "each", "other", "all", "any", "more", "most",
+    "what", "how", "why", "when", "where", "who", "does", "did", "about", "paper",
+}  # fmt: skip
+
+TITLE_BOOST = 1.0
+ABSTRACT_BOOST = 0.5
+ABSTRACT_LENGTH = 1500
+
+
+def tokenize(text):
+    """Lowercase ``text`` and split it into content-bearing terms."""
+    return [
+        term
+        for term in re.findall(r"[a-z0-9]+", text.lower())
+        if len(term) > 2 and term not in STOPWORDS
+    ]
+
+
+def extract_abstract(text):
+    """Return the abstract of a paper, or its opening text if none is marked."""
+    match = re.search(r"\babstract\b[\s:.\-—]*", text, re.IGNORECASE)
+    start = match.end() if match else 0
+    return text[start : start + ABSTRACT_LENGTH]
+
+
+def build_paper_summary(filename, text):
+    """Build the paper-level routing index from title, abstract and body terms.
+
+    Every distinct term in the paper is indexed, so a rare but discriminative
+    word still routes to it. The title is approximated from the file name and
+    the opening text, since extracted PDF text has no reliable title field.
+    """
+    title = os.path.splitext(filename)[0].replace("_", " ") + " " + text[:200]
+    abstract = extract_abstract(text)
+
+    # Sublinear term frequency so long papers don't win on repetition alone
+    counts = Counter(tokenize(text))
+    terms = {term: 1 + math.log(count) for term, count in counts.items()}
+
+    # Title and abstract terms route strongly even if they are rare in the body
+    for term in set(tokenize(abstract)):
+        terms[term] = terms.get(term, 0) + ABSTRACT_BOOST
+    for term in set(tokenize(title)):
+        terms[term] = terms.get(term, 0) + TITLE_BOOST
+
+    return {
+        "title": title.strip(),
+        "abstract": abstract,
+        "terms": terms,
+    }
+
+
+def query_term_weights(query, papers):
+    """Weight each query term by its inverse document frequency in the session.
+
+    Terms found in every paper (or in none) get no weight, since they cannot
+    tell the candidate papers apart.
+    """
+    weights = {}
+    for term in set(tokenize(query)):
+        df = sum(1 for paper in papers if term in paper["summary"]["terms"])
+        if 0 < df < len(papers):
+            weights[term] = math.log(len(papers) / df)
+    return weights
+
+
+def score_paper(term_weights, summary):
+    """Score a paper summary against IDF-weighted query terms."""
+    terms = summary["terms"]
+    return sum(weight * terms.get(term, 0) for term, weight in term_weights.items())
+
+
+def route_papers(query, papers, fanout):
+    """First stage: pick the ``fanout`` papers whose summaries best match ``query``.
+
+    Sessions with no more than ``fanout`` papers, and queries with no term that
+    separates the papers (e.g. "summarize everything"), fall back to every paper.
+    """
+    if fanout <= 0 or len(papers) <= fanout:
+        return papers
+
+    term_weights = query_term_weights(query, papers)
+    if not term_weights:
+        return papers
+
+    scored = [
+        (score_paper(term_weights, paper["summary"]), i)
+        for i, paper in enumerate(papers)
+    ]
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [papers[i] for score, i in scored[:fanout] if score > 0]
+
+
+def get_relevant_paper_content(query, paper_chunks, top_k=3):
+    """Retrieve the most relevant chunks based on simple keyword matching."""
+    # This is a simple approach - for production, consider using embeddings and semantic search
+    query_terms = set(query.lower().split())
+    chunk_scores = []
+
+    for i, chunk in enumerate(paper_chunks):
+        chunk_lower = chunk.lower()
+        score = sum(1 for term in query_terms if term in chunk_lower)
+        chunk_scores.append((i, score))
+
+    # Sort by score in descending order and take top_k
+    relevant_indices = [
+        idx
+        for idx, score in sorted(chunk_scores, key=lambda x: x[1], reverse=True)[:top_k]
+    ]
+    return [paper_chunks[idx] for idx in relevant_indices]
+
+
+def retrieve_chunks(query, papers, fanout):
+    """Two-stage retrieval: route to candidate papers, then score only their chunks."""
+    relevant_chunks = []
+    for paper_info in route_papers(query, papers, fanout):
+        relevant_chunks.extend(get_relevant_paper_content(query, paper_info["chunks"]))
+    return relevant_chunks
@@ -13,6 +13,9 @@ import nltk
 from nltk.tokenize import sent_tokenize
 import re
 
+from admission import AdmissionController, AdmissionRejected, SessionLocks
+from retrieval import build_paper_summary, retrieve_chunks
+
 # Download NLTK data for sentence tokenization
 nltk.download("punkt", quiet=True)
 
@@ -48,6 +51,30 @@ paper_chat_bp = Blueprint("paper_chat", __name__)
 session_papers = {}
 conversation_history = {}
 MAX_HISTORY = 10
+# Number of candidate papers whose chunks are scored for each question
+PAPER_FANOUT = int(os.getenv("PAPER_FANOUT", 5))
+
+# Admission control: bound concurrent work so bursts queue briefly or get a fast
+# 429/503 instead of piling up PDF extraction and LLM calls. The limits apply to
+# this process; under dispatcher.py every worker enforces its own copy, so the
+# effective global limit is the number of workers times these values.
+upload_admission = AdmissionController(
+    "upload_paper",
+    max_active=int(os.getenv("UPLOAD_MAX_ACTIVE", 4)),
+    max_per_session=int(os.getenv("UPLOAD_MAX_PER_SESSION", 2)),
+    max_queue=int(os.getenv("UPLOAD_MAX_QUEUE", 16)),
+    queue_timeout=float(os.getenv("UPLOAD_QUEUE_TIMEOUT", 30)),
+)
+chat_admission = AdmissionController(
+    "chat",
+    max_active=int(os.getenv("CHAT_MAX_ACTIVE", 16)),
+    # Fixed at 1: turns of one session must not interleave in its history
+    max_per_session=1,
+    max_queue=int(os.getenv("CHAT_MAX_QUEUE", 64)),
+    queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT", 15)),
+)
+# Serializes updates to session_papers/conversation_history for a session
+session_locks = SessionLocks()
 
 
 def extract_text_from_pdf(pdf_path):
@@ -109,40 +136,23 @@ def trim_conversation_history(session_id):
         ]
 
 
-def get_relevant_paper_content(query, paper_chunks, top_k=3):
-    """Retrieve the most relevant chunks based on simple keyword matching."""
-    # This is a simple approach - for production, consider using embeddings and semantic search
-    query_terms = set(query.lower().split())
-    chunk_scores = []
-
-    for i, chunk in enumerate(paper_chunks):
-        chunk_lower = chunk.lower()
-        score = sum(1 for term in query_terms if term in chunk_lower)
-        chunk_scores.append((i, score))
-
-    # Sort by score in descending order and take top_k
-    relevant_indices = [
-        idx
-        for idx, score in sorted(chunk_scores, key=lambda x: x[1], reverse=True)[:top_k]
-    ]
-    return [paper_chunks[idx] for idx in relevant_indices]
-
-
 def get_response(session_id, user_input):
     """Get AI response based on paper content and conversation history."""
     global conversation_history
 
-    if session_id not in conversation_history:
-        conversation_history[session_id] = [CHATBOT_SYSTEM_PROMPT]
+    # The session lock only guards reads/updates of the session's state; it is
+    # not held during retrieval or the model call. Turns for one session are
+    # serialized by chat_admission, whose per-session limit is fixed at 1.
+    with session_locks.hold(session_id):
+        if session_id not in conversation_history:
+            conversation_history[session_id] = [CHATBOT_SYSTEM_PROMPT]
+        papers = list(session_papers.get(session_id, []))
 
-    if session_id not in session_papers or not session_papers[session_id]:
+    if not papers:
         return "No research papers have been uploaded for this session. Please upload papers first."
 
-    # Get relevant paper chunks for context
-    relevant_chunks = []
-    for paper_info in session_papers[session_id]:
-        paper_chunks = get_relevant_paper_content(user_input, paper_info["chunks"])
-        relevant_chunks.extend(paper_chunks)
+    # Route to the most relevant papers, then pick chunks from those only
+    relevant_chunks = retrieve_chunks(user_input, papers, PAPER_FANOUT)
 
     # Combine relevant chunks into context (with length limit)
     context = "\n\n".join(relevant_chunks)
@@ -159,37 +169,60 @@ def get_response(session_id, user_input):
             "these excerpts, politely state that you cannot find this information in the papers."
         ),
     }
-
-    conversation_history[session_id].append(context_message)
-    conversation_history[session_id].append({"role": "user", "content": user_input})
-    trim_conversation_history(session_id)
+    user_message = {"role": "user", "content": user_input}
+
+    # The context message is only sent with this turn, never stored in history
+    with session_locks.hold(session_id):
+        history = conversation_history.setdefault(session_id, [CHATBOT_SYSTEM_PROMPT])
+        history.append(user_message)
+        trim_conversation_history(session_id)
+        messages = [
+            *conversation_history[session_id][:-1],
+            context_message,
+            user_message,
+        ]
 
     try:
         completion = client.chat.completions.create(
             model="deepseek-r1-distill-llama-70b",  # Using the Deepseek model via Groq
-            messages=conversation_history[session_id],
+            messages=messages,
             temperature=0.7,
             max_tokens=1024,
             top_p=1,
         )
-
         response_text = completion.choices[0].message.content
-        # Remove the context message for cleaner history
-        conversation_history[session_id].remove(context_message)
-        conversation_history[session_id].append(
-            {"role": "assistant", "content": response_text}
-        )
-        return response_text
-
     except Exception as e:
-        # Remove the context message in case of error
-        conversation_history[session_id].remove(context_message)
         return f"Error getting response: {str(e)}"
 
+    with session_locks.hold(session_id):
+        # The session may have been cleared while the model was answering
+        if session_id in conversation_history:
+            conversation_history[session_id].append(
+                {"role": "assistant", "content": response_text}
+            )
+    return response_text
+
 
 @paper_chat_bp.route("/upload_paper", methods=["POST"])
 def upload_paper():
     """Flask route to handle research paper uploads."""
+    # A session_id in the query string (or X-Session-ID header) lets admission
+    # run before werkzeug reads the up-to-32MB body, bounding memory as well as
+    # CPU. Clients sending it only as a form field are still supported, but their
+    # body is received and parsed before admission, so only the extraction and
+    # chunking work is bounded for them.
+    session_id = request.args.get("session_id") or request.headers.get("X-Session-ID")
+    if not session_id:
+        session_id = request.form.get("session_id")
+    if not session_id:
+        return jsonify({"error": "Session ID is required"}), 400
+
+    with upload_admission.admit(session_id):
+        return process_upload(session_id)
+
+
+def process_upload(session_id):
+    """Save, extract and index an uploaded paper for ``session_id``."""
     if "file" not in request.files:
         return jsonify({"error": "No file part"}), 400
 
@@ -203,10 +236,6 @@ def upload_paper():
             400,
         )
 
-    session_id = request.form.get("session_id")
-    if not session_id:
-        return jsonify({"error": "Session ID is required"}), 400
-
     try:
         # Save the file
         filename = secure_filename(file.filename)
@@ -225,15 +254,18 @@ def upload_paper():
             "filename": filename,
             "upload_time": timestamp,
             "chunks": paper_chunks,
+            "summary": build_paper_summary(filename, processed_text),
         }
 
-        # Initialize session if needed
-        if session_id not in session_papers:
-            session_papers[session_id] = []
-            conversation_history[session_id] = [CHATBOT_SYSTEM_PROMPT]
+        with session_locks.hold(session_id):
+            # Initialize session if needed
+            if session_id not in session_papers:
+                session_papers[session_id] = []
+                conversation_history[session_id] = [CHATBOT_SYSTEM_PROMPT]
 
-        # Add paper to session
-        session_papers[session_id].append(paper_info)
+            # Add paper to session
+            session_papers[session_id].append(paper_info)
+            paper_id = len(session_papers[session_id]) - 1
 
         # Cleanup file (optional - if you don't want to store the PDFs)
         # os.remove(filepath)
@@ -242,7 +274,7 @@ def upload_paper():
             {
                 "success": True,
                 "message": f"Paper '{filename}' uploaded successfully",
-                "paper_id": len(session_papers[session_id]) - 1,
+                "paper_id": paper_id,
             }
         )
 
@@ -265,7 +297,8 @@ def chat():
     if not user_input:
         return jsonify({"error": "Message cannot be empty"}), 400
 
-    response_text = get_response(session_id, user_input)
+    with chat_admission.admit(session_id):
+        response_text = get_response(session_id, user_input)
     return jsonify({"response": response_text})
 
 
@@ -301,11 +334,12 @@ def clear_session():
     if not session_id:
         return jsonify({"error": "Session ID is required"}), 400
 
-    if session_id in session_papers:
-        del session_papers[session_id]
+    with session_locks.hold(session_id):
+        if session_id in session_papers:
+            del session_papers[session_id]
 
-    if session_id in conversation_history:
-        del conversation_history[session_id]
+        if session_id in conversation_history:
+            del conversation_history[session_id]
 
     return jsonify({"success": True, "message": "Session cleared successfully"})
 
@@ -316,6 +350,87 @@ def too_large(e):
     return jsonify({"error": "File is too large"}), 413
 
 
+# Fast rejection when admission control cannot take on more work
+@paper_chat_bp.errorhandler(AdmissionRejected)
+def admission_rejected(e):
+    response = make_response(jsonify({"error": e.message}), e.status)
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+@paper_chat_bp.route("/admission_stats", methods=["GET"])
+def admission_stats():
+    """Flask route to expose queue depth and rejection counts for capacity sizing."""
+    return jsonify(
+        {
+            "upload_paper": upload_admission.stats(),
+            "chat": chat_admission.stats(),
+        }
+    )
+
+
+# Internal routes used by the multi-process dispatcher (see dispatcher.py) to
+# inspect and move this worker's shard of sessions. Only registered on workers.
+shard_bp = Blueprint("shard", __name__)
+
+
+@shard_bp.route("/sessions", methods=["GET"])
+def shard_sessions():
+    """Flask route to list the sessions held by this worker."""
+    session_ids = set(session_papers) | set(conversation_history)
+    return jsonify(
+        {
+            "sessions": sorted(session_ids),
+            "papers": sum(len(papers) for papers in session_papers.values()),
+            "admission": {
+                "upload_paper": upload_admission.stats(),
+                "chat": chat_admission.stats(),
+            },
+        }
+    )
+
+
+@shard_bp.route("/export", methods=["POST"])
+def shard_export():
+    """Flask route to copy sessions out for another worker, keeping them here.
+
+    The dispatcher only drops the originals once the copies have been imported,
+    so a failed move never loses a session.
+    """
+    sessions = {}
+    for session_id in request.json.get("session_ids", []):
+        with session_locks.hold(session_id):
+            sessions[session_id] = {
+                "papers": session_papers.get(session_id, []),
+                "history": conversation_history.get(session_id),
+            }
+    return jsonify({"sessions": sessions})
+
+
+@shard_bp.route("/import", methods=["POST"])
+def shard_import():
+    """Flask route to take ownership of sessions exported by another worker."""
+    sessions = request.json.get("sessions", {})
+    for session_id, state in sessions.items():
+        with session_locks.hold(session_id):
+            # Replace rather than merge so retrying a failed move is harmless
+            session_papers[session_id] = state["papers"]
+            if state["history"] is not None:
+                conversation_history[session_id] = state["history"]
+    return jsonify({"success": True, "imported": len(sessions)})
+
+
+@shard_bp.route("/drop", methods=["POST"])
+def shard_drop():
+    """Flask route to forget sessions that now live on another worker."""
+    session_ids = request.json.get("session_ids", [])
+    for session_id in session_ids:
+        with session_locks.hold(session_id):
+            session_papers.pop(session_id, None)
+            conversation_history.pop(session_id, None)
+    return jsonify({"success": True, "dropped": len(session_ids)})
+
+
 # Global variable to store ngrok process
 ngrok_process = None
 
@@ -380,6 +495,13 @@ def create_app():
     return app
 
 
+# Create Flask application for a dispatcher-managed worker process
+def create_worker_app():
+    app = create_app()
+    app.register_blueprint(shard_bp, url_prefix="/internal")
+    return app
+
+
 if __name__ == "__main__":
     # Set up signal handlers for graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
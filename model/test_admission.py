@@ -0,0 +1,176 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, SessionLocks
+
+
+def make_controller(**overrides):
+    config = dict(max_active=4, max_per_session=1, max_queue=2, queue_timeout=2)
+    config.update(overrides)
+    return AdmissionController("test", **config)
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+class Holder:
+    """Hold an admission slot in a background thread until released."""
+
+    def __init__(self, controller, session_id, log=None):
+        self.release = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(
+            target=self._run, args=(controller, session_id, log)
+        )
+        self.thread.start()
+
+    def _run(self, controller, session_id, log):
+        try:
+            with controller.admit(session_id):
+                if log is not None:
+                    log.append(session_id)
+                self.release.wait(5)
+        except AdmissionRejected as e:
+            self.error = e
+
+    def finish(self):
+        self.release.set()
+        self.thread.join()
+
+
+def test_session_blocked_waiters_do_not_fill_global_queue():
+    controller = make_controller()
+    holders = [Holder(controller, "a"), Holder(controller, "b")]
+    wait_until(lambda: controller.stats()["active"] == 2)
+    holders += [Holder(controller, "a"), Holder(controller, "b")]
+    wait_until(lambda: controller.stats()["session_waiting"] == 2)
+
+    # Two of four global slots are free, so a new session starts right away
+    with controller.admit("c"):
+        assert controller.stats()["active"] == 3
+    assert controller.stats()["queue_depth"] == 0
+
+    for holder in holders:
+        holder.finish()
+    assert all(holder.error is None for holder in holders)
+
+
+def test_waiters_are_served_in_arrival_order():
+    controller = make_controller(max_active=1, max_queue=5)
+    log = []
+    first = Holder(controller, "first", log)
+    wait_until(lambda: log == ["first"])
+
+    waiters = []
+    for session_id in ["w1", "w2", "w3"]:
+        waiters.append(Holder(controller, session_id, log))
+        wait_until(lambda: controller.stats()["queue_depth"] == len(waiters))
+
+    first.finish()
+    for served, waiter in enumerate(waiters, start=2):
+        wait_until(lambda: len(log) == served)
+        waiter.finish()
+
+    assert log == ["first", "w1", "w2", "w3"]
+
+
+def test_newcomer_does_not_overtake_waiter():
+    controller = make_controller(max_active=1, max_queue=5)
+    log = []
+    first = Holder(controller, "first", log)
+    wait_until(lambda: log == ["first"])
+    waiter = Holder(controller, "waiter", log)
+    wait_until(lambda: controller.stats()["queue_depth"] == 1)
+
+    first.finish()
+    newcomer = Holder(controller, "newcomer", log)
+    wait_until(lambda: len(log) >= 2)
+    waiter.finish()
+    newcomer.finish()
+
+    assert log == ["first", "waiter", "newcomer"]
+
+
+def test_second_waiter_for_session_is_rejected_with_429():
+    controller = make_controller()
+    holder = Holder(controller, "a")
+    wait_until(lambda: controller.stats()["active"] == 1)
+    waiter = Holder(controller, "a")
+    wait_until(lambda: controller.stats()["session_waiting"] == 1)
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        with controller.admit("a"):
+            pass
+    assert excinfo.value.status == 429
+    assert excinfo.value.retry_after >= 1
+
+    holder.finish()
+    waiter.finish()
+    assert controller.stats()["rejected"]["session_limit"] == 1
+
+
+def test_full_queue_is_rejected_with_503():
+    controller = make_controller(max_active=1, max_queue=1)
+    holder = Holder(controller, "a")
+    wait_until(lambda: controller.stats()["active"] == 1)
+    waiter = Holder(controller, "b")
+    wait_until(lambda: controller.stats()["queue_depth"] == 1)
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        with controller.admit("c"):
+            pass
+    assert excinfo.value.status == 503
+    assert excinfo.value.retry_after >= 1
+
+    holder.finish()
+    waiter.finish()
+    assert controller.stats()["rejected"]["queue_full"] == 1
+
+
+def test_waiter_times_out_with_503():
+    controller = make_controller(max_active=1, queue_timeout=0.1)
+    holder = Holder(controller, "a")
+    wait_until(lambda: controller.stats()["active"] == 1)
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        with controller.admit("b"):
+            pass
+    assert excinfo.value.status == 503
+
+    holder.finish()
+    stats = controller.stats()
+    assert stats["rejected"]["timeout"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_session_locks_are_dropped_once_released():
+    locks = SessionLocks()
+    with locks.hold("a"):
+        with locks.hold("b"):
+            assert len(locks) == 2
+    assert len(locks) == 0
+
+
+def test_session_lock_is_shared_while_waited_on():
+    locks = SessionLocks()
+    log = []
+
+    def second():
+        with locks.hold("a"):
+            log.append("second")
+
+    with locks.hold("a"):
+        thread = threading.Thread(target=second)
+        thread.start()
+        time.sleep(0.05)
+        log.append("first")
+    thread.join()
+
+    assert log == ["first", "second"]
+    assert len(locks) == 0